@@ -1,3 +1,6 @@
+import asyncio
+import sys
+
 from dotenv import load_dotenv
 from livekit import agents
 from livekit.agents import Agent, AgentSession, RoomInputOptions
@@ -5,8 +8,15 @@ from livekit.plugins import openai
 
 load_dotenv()
 
+# Use uvloop for the worker processes' event loops (not available on Windows)
+if sys.platform != "win32":
+    import uvloop
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
 async def entrypoint(ctx: agents.JobContext):
-    await ctx.connect()
+    await ctx.connect(auto_subscribe=agents.AutoSubscribe.AUDIO_ONLY)
 
     session = AgentSession(
         llm=openai.realtime.RealtimeModel(
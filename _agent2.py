@@ -1,4 +1,6 @@
+import asyncio
 import os
+import sys
 
 from dotenv import load_dotenv
 from livekit import agents
@@ -17,6 +19,12 @@ from livekit.plugins.turn_detector.multilingual import MultilingualModel
 
 load_dotenv()
 
+# Use uvloop for the worker processes' event loops (not available on Windows)
+if sys.platform != "win32":
+    import uvloop
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
 
 class Assistant(Agent):
     def __init__(self) -> None:
@@ -24,12 +32,12 @@ class Assistant(Agent):
 
 
 async def entrypoint(ctx: agents.JobContext):
-    await ctx.connect()
+    await ctx.connect(auto_subscribe=agents.AutoSubscribe.AUDIO_ONLY)
 
     eleven_tts = tts.TTS(
         api_key=os.environ.get("ELEVENLABS_API_KEY"),
-        model="eleven_turbo_v2_5",
-        # model="eleven_flash_v2_5",
+        model="eleven_flash_v2_5",
+        # model="eleven_turbo_v2_5",
         voice=tts.Voice(
             id="YKUjKbMlejgvkOZlnnvt",
             name="Alejandro Ballesteros",
@@ -37,9 +45,8 @@ async def entrypoint(ctx: agents.JobContext):
             settings=tts.VoiceSettings(stability=1, similarity_boost=1, use_speaker_boost=True),
         ),
         language="es",
-        streaming_latency=3,
         enable_ssml_parsing=False,
-        chunk_length_schedule=[80, 120, 200, 260],
+        chunk_length_schedule=[50, 90, 150, 250],
     )
 
     session = AgentSession(
@@ -61,9 +68,8 @@ async def entrypoint(ctx: agents.JobContext):
         ),
     )
 
-    await session.generate_reply(
-        instructions="Greet the user and offer your assistance."
-    )
+    # Fixed greeting: spoken directly, no LLM round-trip
+    await session.say("Hello! How can I help you today?")
 
 
 if __name__ == "__main__":
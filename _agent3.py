@@ -6,11 +6,13 @@ Este módulo implementa un asistente de voz utilizando LiveKit y varios plugins
 para proporcionar una experiencia conversacional completa.
 """
 
+import asyncio
 import logging
 import os
+import sys
 from typing import Optional
 
-from dotenv import load_dotenv
+from dotenv import dotenv_values
 from functions import AssistantFnc
 from livekit.agents import (
     AutoSubscribe,
@@ -31,6 +33,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger("voice-agent")
 
+# uvloop reemplaza el bucle de asyncio en los procesos del worker (no disponible en Windows)
+if sys.platform != "win32":
+    import uvloop
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
+def _parse_env(path: str) -> dict:
+    """Lee y parsea el archivo de entorno; un archivo inexistente devuelve un dict vacío."""
+    return {key: value for key, value in dotenv_values(path).items() if value is not None}
+
 
 class VoiceAssistantApp:
     """
@@ -53,22 +66,46 @@ class VoiceAssistantApp:
     def _load_environment():
         """Carga las variables de entorno desde el archivo .env.local"""
         env_path = ".env.local"
-        if os.path.exists(env_path):
-            load_dotenv(dotenv_path=env_path)
+        parsed = _parse_env(env_path)
+        if parsed:
+            # Igual que load_dotenv: no sobrescribir variables ya definidas
+            for key, value in parsed.items():
+                os.environ.setdefault(key, value)
+        elif os.path.exists(env_path):
+            logger.warning(f"Archivo {env_path} vacío o sin valores. Usando variables de entorno del sistema.")
         else:
             logger.warning(f"Archivo {env_path} no encontrado. Usando variables de entorno del sistema.")
 
     @staticmethod
     def prewarm(proc: JobProcess):
         """
-        Función de precalentamiento que carga modelos pesados antes de procesar trabajos.
+        Función de precalentamiento que carga modelos pesados y los clientes
+        STT/LLM/TTS antes de procesar trabajos, para reutilizarlos entre llamadas.
 
         Args:
             proc: El proceso de trabajo donde almacenar componentes precargados.
         """
-        proc.userdata["vad"] = silero.VAD.load(activation_threshold=0.9)
+        # Silencio corto para cerrar turnos antes; el detector de turnos filtra falsos finales
+        proc.userdata["vad"] = silero.VAD.load(
+            activation_threshold=0.5,
+            min_silence_duration=0.3,
+            min_speech_duration=0.1,
+            prefix_padding_duration=0.2,
+            sample_rate=16000,
+        )
+        proc.userdata["stt"] = deepgram.STT(
+            language="es",
+            # Fija los valores por defecto del plugin (streaming con resultados parciales)
+            interim_results=True,
+            no_delay=True,
+            smart_format=True,
+            endpointing_ms=25,
+        )
+        proc.userdata["llm"] = openai.LLM(model="gpt-4o-mini", temperature=0.7)
+        proc.userdata["tts"] = VoiceAssistantApp._create_tts_engine()
 
-    def _create_tts_engine(self) -> tts.TTS:
+    @staticmethod
+    def _create_tts_engine() -> tts.TTS:
         """
         Crea y configura el motor de text-to-speech.
 
@@ -82,7 +119,7 @@ class VoiceAssistantApp:
 
         return tts.TTS(
             api_key=api_key,
-            model="eleven_turbo_v2_5",
+            model="eleven_flash_v2_5",
             voice=tts.Voice(
                 id="YKUjKbMlejgvkOZlnnvt",
                 name="Alejandro Ballesteros",
@@ -94,17 +131,16 @@ class VoiceAssistantApp:
                 ),
             ),
             language="es",
-            streaming_latency=3,
             enable_ssml_parsing=False,
-            chunk_length_schedule=[80, 120, 200, 260],
+            chunk_length_schedule=[50, 90, 150, 250],
         )
 
-    def _create_agent(self, vad, fnc_ctx) -> VoicePipelineAgent:
+    def _create_agent(self, userdata: dict, fnc_ctx) -> VoicePipelineAgent:
         """
         Crea y configura el agente de voz con todos sus componentes.
 
         Args:
-            vad: Detector de actividad de voz precargado.
+            userdata: Componentes precargados en `prewarm` (VAD, STT, LLM y TTS).
             fnc_ctx: Contexto de funciones del asistente.
 
         Returns:
@@ -118,13 +154,15 @@ class VoiceAssistantApp:
 
         # Crear el agente
         return VoicePipelineAgent(
-            vad=vad,
-            stt=deepgram.STT(language="es"),
-            llm=openai.LLM(model="gpt-4o-mini", temperature=0.7),
-            tts=self._create_tts_engine(),
+            vad=userdata["vad"],
+            stt=userdata["stt"],
+            llm=userdata["llm"],
+            tts=userdata["tts"],
+            # El detector de turnos depende del contexto del trabajo, no puede precargarse
             turn_detector=turn_detector.EOUModel(),
             min_endpointing_delay=0.5,
             max_endpointing_delay=5.0,
+            preemptive_synthesis=True,
             chat_ctx=initial_ctx,
             fnc_ctx=fnc_ctx,
             max_nested_fnc_calls=5,
@@ -138,19 +176,29 @@ class VoiceAssistantApp:
             ctx: El contexto del trabajo actual.
         """
         logger.info(f"Conectando a la sala {ctx.room.name}")
-        await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
+        connect_task = asyncio.create_task(ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY))
+        # Ceder el control para que la conexión arranque antes del trabajo síncrono
+        await asyncio.sleep(0)
+
+        try:
+            # Configurar el contexto de funciones y el agente mientras se conecta
+            fnc_ctx = AssistantFnc()
+            fnc_ctx.room_name = ctx.room.name
+            agent = self._create_agent(ctx.proc.userdata, fnc_ctx)
+
+            # wait_for_participant exige que la sala ya esté conectada
+            await connect_task
+        finally:
+            # Si la preparación falla, no dejar una conexión a medio abrir
+            if not connect_task.done():
+                connect_task.cancel()
 
         # Esperar a que se conecte el primer participante
         participant = await ctx.wait_for_participant()
         logger.info(f"Iniciando asistente de voz para el participante {participant.identity}")
-
-        # Configurar el contexto de funciones
-        fnc_ctx = AssistantFnc()
-        fnc_ctx.room_name = ctx.room.name
         fnc_ctx.participant_identity = participant.identity
 
-        # Crear y arrancar el agente
-        agent = self._create_agent(ctx.proc.userdata["vad"], fnc_ctx)
+        # Arrancar el agente
         agent.start(ctx.room, participant)
 
         # Mensaje de bienvenida
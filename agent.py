@@ -1,22 +1,30 @@
 import asyncio
 import logging
 import os
+import sys
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+from typing import ClassVar
 
+import aiohttp
 from dotenv import load_dotenv
 
 # from livekit import agents
-from livekit import api
+from livekit import api, rtc
 from livekit.agents import (
     Agent,
     AgentSession,
+    APIConnectOptions,
+    AutoSubscribe,
     JobContext,
     JobProcess,
     RoomInputOptions,
+    RunContext,
     WorkerOptions,
     cli,
 )
-from livekit.agents.events import RunContext
 from livekit.agents.llm import function_tool
+from livekit.agents.utils import http_context
 from livekit.agents.voice import Agent
 from livekit.plugins import deepgram, openai, silero
 from livekit.plugins.elevenlabs import tts
@@ -30,6 +38,58 @@ load_dotenv(dotenv_path=".env")
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("voice-agent")
 
+# uvloop reemplaza el bucle de asyncio en los procesos del worker (no disponible en Windows)
+if sys.platform != "win32":
+    import uvloop
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
+@dataclass(frozen=True)
+class AgentConfig:
+    """Credenciales del agente, resueltas y validadas una sola vez por proceso en `prewarm`."""
+
+    elevenlabs_api_key: str
+    livekit_url: str
+    livekit_api_key: str
+    livekit_api_secret: str
+
+    # Variable de entorno de la que se lee cada campo
+    ENV_VARS: ClassVar[dict[str, str]] = {
+        "elevenlabs_api_key": "ELEVENLABS_API_KEY",
+        "livekit_url": "LIVEKIT_URL",
+        "livekit_api_key": "LIVEKIT_API_KEY",
+        "livekit_api_secret": "LIVEKIT_API_SECRET",
+    }
+
+    def __post_init__(self):
+        missing = [self.ENV_VARS[name] for name, value in vars(self).items() if not value]
+        if missing:
+            raise ValueError(f"Faltan variables de entorno: {', '.join(missing)}")
+
+    @classmethod
+    def from_env(cls) -> "AgentConfig":
+        """Construye la configuración a partir de las variables de entorno."""
+        return cls(**{field: os.environ.get(env, "") for field, env in cls.ENV_VARS.items()})
+
+
+# Mensajes fijos: se dicen tal cual, sin pasar por el LLM
+GREETING = "¡Hola! Soy tu asistente, ¿en qué puedo ayudarte?"
+TRANSFER_NOTICE = "En un momento sera transferido al deparamento de {department}. Por favor, no cuelgue la llamada."
+TRANSFER_FAILED = "Lo sentimos, no fue posible llevar a cabo la transferencia en estos momentos. ¿Hay algo mas en lo que te pueda apoyar?"
+
+# Límite para precargar el saludo dentro de prewarm (el worker concede 10 s en total)
+GREETING_SYNTH_TIMEOUT = 4.0
+
+
+@dataclass
+class SessionData:
+    """Datos compartidos por la sesión y accesibles desde las herramientas."""
+
+    ctx: JobContext
+    livekit_api: api.LiveKitAPI
+    selected_department: str | None = None
+
 
 class Assistant(Agent):
     """Asistente de voz personalizado."""
@@ -45,6 +105,7 @@ class Assistant(Agent):
         self.room_name = None
         self.participant_identity = None
         self.session_data = {}
+        self._transfer_task: asyncio.Task | None = None
 
     def set_data(self, key, value):
         """Almacena datos en el contexto."""
@@ -54,19 +115,26 @@ class Assistant(Agent):
         """Recupera datos del contexto."""
         return self.session_data.get(key, default)
 
-    @function_tool()
-    async def transfer_call(self, ctx: RunContext):
+    @function_tool(name="transfer_call")
+    async def transfer_call_tool(self, ctx: RunContext[SessionData]):
         """Transfiere la llamada de una manera despectiva, donde indiques tu molestia al no querer ser atendido."""
 
-        room = ctx.userdata.ctx.room
-        identity = room.local_participant.identity
+        if self._transfer_task is not None and not self._transfer_task.done():
+            # Ya hay una transferencia en curso: no iniciar otra
+            return None
+
+        identity = self.participant_identity
         transfer_number = f"sip:5652917934@127.0.0.1:49999"
         dept_name = "Agente"
         ctx.userdata.selected_department = dept_name
 
-        await self._handle_transfer(identity, transfer_number, dept_name)
-        return f"Transferring to {dept_name} department."
-
+        # La herramienta no puede esperar la reproducción de un mensaje propio sin
+        # bloquear el turno actual, así que la transferencia continúa en segundo plano
+        self._transfer_task = asyncio.create_task(
+            self._handle_transfer(identity, transfer_number, dept_name)
+        )
+        # Sin resultado el LLM no genera otra respuesta que compita con la transferencia
+        return None
 
     async def _handle_transfer(
         self, identity: str, transfer_number: str, department: str
@@ -79,13 +147,22 @@ class Assistant(Agent):
             transfer_number (str): The number to transfer to
             department (str): The name of the department
         """
-        await self.session.generate_reply(
-            user_input=f"En un momento sera transferido al deparamento de {department}. Por favor, no cuelgue la llamada."
-        )
-        await asyncio.sleep(6)
-        await self.transfer_call(identity, transfer_number)
+        try:
+            handle = self.session.say(
+                TRANSFER_NOTICE.format(department=department),
+                # Si el usuario habla encima, la transferencia no debe dispararse a mitad del aviso
+                allow_interruptions=False,
+            )
+            # Transferir en cuanto termine de reproducirse el aviso
+            await handle.wait_for_playout()
+        except Exception as e:
+            # say() falla si la sesión ya se cerró; nadie espera esta tarea, así que se registra aquí
+            logger.error(f"Failed to announce transfer: {e}", exc_info=True)
+            return
+
+        await self._do_sip_transfer(identity, transfer_number)
 
-    async def transfer_call(self, participant_identity: str, transfer_to: str) -> None:
+    async def _do_sip_transfer(self, participant_identity: str, transfer_to: str) -> None:
         """
         Transfer the SIP call to another number.
 
@@ -97,63 +174,34 @@ class Assistant(Agent):
 
         try:
             userdata = self.session.userdata
-            if not userdata.livekit_api:
-                livekit_url = os.getenv('LIVEKIT_URL')
-                api_key = os.getenv('LIVEKIT_API_KEY')
-                api_secret = os.getenv('LIVEKIT_API_SECRET')
-                logger.debug(f"Initializing LiveKit API client with URL: {livekit_url}")
-                userdata.livekit_api = api.LiveKitAPI(
-                    url=livekit_url,
-                    api_key=api_key,
-                    api_secret=api_secret
-                )
-
             transfer_request = proto_sip.TransferSIPParticipantRequest(
                 participant_identity=participant_identity,
                 room_name=userdata.ctx.room.name,
                 transfer_to=transfer_to,
                 play_dialtone=True
             )
-            logger.debug(f"Transfer request: {transfer_request}")
+            # Formato diferido: el protobuf solo se convierte a texto si DEBUG está activo
+            logger.debug("Transfer request: %s", transfer_request)
 
             await userdata.livekit_api.sip.transfer_sip_participant(transfer_request)
             logger.info(f"Successfully transferred participant {participant_identity} to {transfer_to}")
 
         except Exception as e:
             logger.error(f"Failed to transfer call: {e}", exc_info=True)
-            await self.session.generate_reply(user_input="Lo sentimos, no fue posible llevar a cabo la transferencia en estos momentos. Hay algo mas en lo que te pueda apoyar?")
-
+            try:
+                self.session.say(TRANSFER_FAILED)
+            except RuntimeError as e:
+                logger.error(f"Failed to announce transfer failure: {e}")
 
-def prewarm(proc: JobProcess):
-    """Precarga el modelo VAD para detección de voz."""
-    proc.userdata["vad"] = silero.VAD.load(activation_threshold=0.9)
-
-
-async def entrypoint(ctx: JobContext):
-    """Punto de entrada principal del asistente de voz."""
-
-    # Conectar a la sala
-    logger.info(f"Conectando a la sala {ctx.room.name}")
-    await ctx.connect()
 
-    # Esperar al primer participante
-    participant = await ctx.wait_for_participant()
-    logger.info(f"Iniciando asistente para {participant.identity}")
-
-    # Crear instancia del asistente
-    assistant = Assistant()
-    assistant.room_name = ctx.room.name
-    assistant.participant_identity = participant.identity
-
-    # Configurar datos iniciales (ejemplo)
-    assistant.set_data("start_time", "now")
-    assistant.set_data("language", "es")
-
-    # Configurar el motor TTS de ElevenLabs
-    eleven_tts = tts.TTS(
+def _create_tts(
+    config: AgentConfig, http_session: aiohttp.ClientSession | None = None
+) -> tts.TTS:
+    """Configura el motor TTS de ElevenLabs."""
+    return tts.TTS(
         voice_id="YKUjKbMlejgvkOZlnnvt",
-        api_key=os.environ.get("ELEVENLABS_API_KEY"),
-        model="eleven_turbo_v2_5",
+        api_key=config.elevenlabs_api_key,
+        model="eleven_flash_v2_5",
         # voice_settings=tts.Voice(
         #     id="YKUjKbMlejgvkOZlnnvt",
         #     name="Alejandro Ballesteros",
@@ -161,20 +209,122 @@ async def entrypoint(ctx: JobContext):
         #     # voice_settings=tts.VoiceSettings(stability=1, similarity_boost=1, use_speaker_boost=True),
         # ),
         language="es",
-        streaming_latency=3,
+        # Fija el valor por defecto del plugin (MP3 22.05kHz/32kbps); no cambia nada en ejecución
+        encoding="mp3_22050_32",
         enable_ssml_parsing=False,
-        chunk_length_schedule=[80, 120, 200, 260],
+        # Primer fragmento en el mínimo de ElevenLabs (50) para empezar a sintetizar antes
+        chunk_length_schedule=[50, 90, 150, 250],
+        http_session=http_session,
     )
 
-    # Crear y configurar la sesión
-    session = AgentSession(
-        stt=deepgram.STT(model="nova-2", language="es"),  # Configurado para español
-        llm=openai.LLM(model="gpt-4o-mini", temperature=0.7),
-        tts=eleven_tts,  # Usamos ElevenLabs en lugar de Cartesia
-        vad=ctx.proc.userdata["vad"],
-        turn_detection=MultilingualModel(),
-        # turn_detector=turn_detector.EOUModel(),
+
+def _synthesize_greeting(config: AgentConfig) -> list[rtc.AudioFrame]:
+    """Sintetiza el saludo una sola vez por proceso, fuera del contexto de un trabajo."""
+
+    async def _run() -> list[rtc.AudioFrame]:
+        # Sin trabajo activo no hay sesión HTTP compartida: se usa una temporal
+        async with aiohttp.ClientSession() as http_session:
+            async with _create_tts(config, http_session=http_session).synthesize(
+                GREETING,
+                conn_options=APIConnectOptions(max_retry=0, timeout=GREETING_SYNTH_TIMEOUT),
+            ) as stream:
+                return [ev.frame async for ev in stream]
+
+    # El worker mata el proceso si prewarm tarda más de 10 s; mejor rendirse antes
+    return asyncio.run(asyncio.wait_for(_run(), timeout=GREETING_SYNTH_TIMEOUT))
+
+
+async def _replay(frames: list[rtc.AudioFrame]) -> AsyncIterator[rtc.AudioFrame]:
+    """Reproduce frames de audio ya sintetizados."""
+    for frame in frames:
+        yield frame
+
+
+def prewarm(proc: JobProcess):
+    """Precarga el VAD, los clientes STT/LLM/TTS y el audio del saludo."""
+    # Falla al arrancar el proceso si falta alguna credencial, no a mitad de una llamada;
+    # se valida aquí y no al importar para no romper `download-files` ni `console`
+    config = AgentConfig.from_env()
+    proc.userdata["config"] = config
+
+    # Silencio corto para cerrar turnos antes; el detector de turnos filtra falsos finales
+    proc.userdata["vad"] = silero.VAD.load(
+        activation_threshold=0.5,
+        min_silence_duration=0.3,
+        min_speech_duration=0.1,
+        prefix_padding_duration=0.2,
+        sample_rate=16000,
     )
+    # STT y TTS se crean sin http_session: durante el trabajo ambos (y el cliente de
+    # LiveKit) toman la misma aiohttp.ClientSession del trabajo y comparten el pool
+    proc.userdata["stt"] = deepgram.STT(
+        model="nova-2",
+        language="es",  # Configurado para español
+        # Fija los valores por defecto del plugin; el fin de turno lo decide VAD + detector de turnos
+        interim_results=True,
+        no_delay=True,
+        smart_format=True,
+        endpointing_ms=25,
+    )
+    proc.userdata["llm"] = openai.LLM(model="gpt-4o-mini", temperature=0.7)
+    proc.userdata["tts"] = _create_tts(config)
+
+    try:
+        proc.userdata["greeting_frames"] = _synthesize_greeting(config)
+    except Exception as e:
+        # Sin audio precargado el saludo se sintetiza en vivo al empezar la llamada
+        logger.warning(f"No se pudo precargar el saludo: {e!r}")
+
+
+async def entrypoint(ctx: JobContext):
+    """Punto de entrada principal del asistente de voz."""
+
+    # Conectar a la sala en segundo plano mientras se prepara la sesión
+    logger.info(f"Conectando a la sala {ctx.room.name}")
+    connect_task = asyncio.create_task(ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY))
+    # Ceder el control para que la conexión arranque antes del trabajo síncrono
+    await asyncio.sleep(0)
+
+    try:
+        # Crear instancia del asistente
+        assistant = Assistant()
+        assistant.room_name = ctx.room.name
+
+        # Configurar datos iniciales (ejemplo)
+        assistant.set_data("start_time", "now")
+        assistant.set_data("language", "es")
+
+        # Crear y configurar la sesión
+        # Un único cliente de LiveKit por llamada, sobre la sesión HTTP del trabajo
+        config: AgentConfig = ctx.proc.userdata["config"]
+        livekit_api = api.LiveKitAPI(
+            url=config.livekit_url,
+            api_key=config.livekit_api_key,
+            api_secret=config.livekit_api_secret,
+            session=http_context.http_session(),
+        )
+        session = AgentSession[SessionData](
+            userdata=SessionData(ctx=ctx, livekit_api=livekit_api),
+            stt=ctx.proc.userdata["stt"],
+            llm=ctx.proc.userdata["llm"],
+            tts=ctx.proc.userdata["tts"],  # Usamos ElevenLabs en lugar de Cartesia
+            vad=ctx.proc.userdata["vad"],
+            # El detector de turnos depende del contexto del trabajo, no puede precargarse
+            turn_detection=MultilingualModel(),
+            # turn_detector=turn_detector.EOUModel(),
+        )
+
+        # wait_for_participant exige que la sala ya esté conectada
+        await connect_task
+    finally:
+        # Si la preparación falla, no dejar una conexión a medio abrir
+        if not connect_task.done():
+            connect_task.cancel()
+
+    # Esperar al primer participante
+    participant = await ctx.wait_for_participant()
+    logger.info(f"Iniciando asistente para {participant.identity}")
+    assistant.participant_identity = participant.identity
 
     # Iniciar la sesión
     await session.start(
@@ -187,9 +337,11 @@ async def entrypoint(ctx: JobContext):
     )
 
     # Mensaje de bienvenida
-    await session.generate_reply(
-        instructions="Saluda al usuario en español y ofrece tu ayuda."
-    )
+    greeting_frames = ctx.proc.userdata.get("greeting_frames")
+    if greeting_frames:
+        await session.say(GREETING, audio=_replay(greeting_frames))
+    else:
+        await session.say(GREETING)
 
 
 if __name__ == "__main__":